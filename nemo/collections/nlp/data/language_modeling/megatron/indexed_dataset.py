@@ -73,7 +73,9 @@ def infer_dataset_impl(path):
         return None
 
 
-def make_builder(out_file, impl, vocab_size=None, chunk_size=64, pad_id=0, retrieval_db=False, stride=64):
+def make_builder(
+    out_file, impl, vocab_size=None, chunk_size=64, pad_id=0, retrieval_db=False, stride=64, index_version=1
+):
     if impl == 'mmap':
         return MMapIndexedDatasetBuilder(out_file, dtype=__best_fitting_dtype(vocab_size))
     elif impl == 'retmmap':
@@ -84,6 +86,7 @@ def make_builder(out_file, impl, vocab_size=None, chunk_size=64, pad_id=0, retri
             retrieval_db=retrieval_db,
             dtype=__best_fitting_dtype(vocab_size),
             stride=stride,
+            index_version=index_version,
         )
     else:
         return IndexedDatasetBuilder(out_file)
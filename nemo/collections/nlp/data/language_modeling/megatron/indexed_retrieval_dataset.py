@@ -17,11 +17,12 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import ctypes
+import mmap
 import os
 import shutil
 import struct
-from functools import lru_cache
-from itertools import accumulate
+import sys
 from typing import List
 
 import numpy as np
@@ -35,11 +36,15 @@ __all__ = ["KNNIndex", "MMapRetrievalIndexedDataset", "MMapRetrievalIndexedDatas
 dtypes = {1: np.uint8, 2: np.int8, 3: np.int16, 4: np.int32, 5: np.int64, 6: np.float64, 7: np.double, 8: np.uint16}
 
 
+# reverse lookup of `dtypes`, the first code wins for aliases such as np.float64 and np.double
+_dtype_codes = {np.dtype(v): k for k, v in reversed(dtypes.items())}
+
+
 def code(dtype):
-    for k in dtypes.keys():
-        if dtypes[k] == dtype:
-            return k
-    raise ValueError(dtype)
+    try:
+        return _dtype_codes[np.dtype(dtype)]
+    except (KeyError, TypeError):
+        raise ValueError(dtype)
 
 
 def index_file_path(prefix_path):
@@ -50,10 +55,97 @@ def data_file_path(prefix_path):
     return prefix_path + '.bin'
 
 
-def _warmup_mmap_file(path):
-    with open(path, 'rb') as stream:
-        while stream.read(100 * 1024 * 1024):
-            pass
+# magic, version, K, number of chunks, chunk start
+_KNN_HEADER = struct.Struct('<9sQQQQ')
+# magic, version
+_RETRIEVAL_HEADER = struct.Struct('<9sL')
+# stride, dtype code, number of docs, chunk size, number of chunks, retrieval db flag
+_RETRIEVAL_META = struct.Struct('<LBQQQB')
+# limits of the int32 chunk ids and the uint32 chunk addresses (in units of stride tokens) of the index version 2
+_MAX_COMPACT_CHUNKS = 2**31
+_MAX_COMPACT_ADDRESS = 2**32
+
+
+# bytes of a mapping queried per mincore call, one status byte per page is needed for each window
+_MINCORE_WINDOW = 1 << 30
+
+
+def _is_resident(bin_buffer_mmap, fraction=0.95):
+    """
+    Whether more than `fraction` of the pages of a memory mapped file are already in the page cache.
+    It returns False when the residency cannot be queried.
+    Since Linux 5.0, mincore only reports page cache residency for files the caller owns
+    or could open for writing (or when running as root). For other files, e.g. read-only
+    shared datasets, it only sees the pages mapped by this process, so it returns False
+    for a fresh mapping even if the file is fully cached.
+    """
+    length = bin_buffer_mmap.nbytes
+    if length == 0 or not sys.platform.startswith('linux'):
+        return False
+    try:
+        mincore = ctypes.CDLL(None, use_errno=True).mincore
+    except (OSError, AttributeError):
+        return False
+    mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+    page_size = mmap.PAGESIZE
+    # stop as soon as more pages are missing than the fraction allows
+    max_missing = (1 - fraction) * ((length + page_size - 1) // page_size)
+    vec = np.empty(_MINCORE_WINDOW // page_size, dtype=np.uint8)
+    address = bin_buffer_mmap.ctypes.data
+    missing = 0
+    for start in range(0, length, _MINCORE_WINDOW):
+        size = min(_MINCORE_WINDOW, length - start)
+        num_pages = (size + page_size - 1) // page_size
+        if mincore(address + start, size, vec.ctypes.data) != 0:
+            return False
+        missing += num_pages - np.count_nonzero(vec[:num_pages] & 1)
+        if missing >= max_missing:
+            return False
+    return True
+
+
+def _warmup_mmap_file(path, bin_buffer_mmap):
+    """
+    Warm up the page cache for a memory mapped file.
+    Rather than reading the whole file through a userspace buffer, hint the kernel
+    to schedule large readahead I/Os directly into the page cache. No page tables are
+    populated, the pages are mapped on first access. Platforms without madvise or
+    posix_fadvise read the file through instead.
+    It is skipped when the file is already resident, e.g. when resuming within the same job,
+    as far as `_is_resident` can tell, see its limitations for read-only files.
+    """
+    if _is_resident(bin_buffer_mmap):
+        return
+    if hasattr(mmap, 'MADV_WILLNEED'):
+        bin_buffer_mmap._mmap.madvise(mmap.MADV_WILLNEED)
+    elif hasattr(os, 'posix_fadvise'):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    else:
+        with open(path, 'rb') as stream:
+            while stream.read(100 * 1024 * 1024):
+                pass
+
+
+def _drop_page_cache(path):
+    """
+    Hint the kernel that the cached pages of a closed memory mapped file are no longer needed,
+    so cycling through large datasets does not evict other useful data from the page cache.
+    Pages still mapped by other processes are kept.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
 
 
 class KNNIndex(object):
@@ -80,13 +172,8 @@ class KNNIndex(object):
         class _Writer(object):
             def __enter__(self):
                 self._file = open(path, 'wb')
-                self._file.write(cls._HDR_MAGIC)
-                self._file.write(struct.pack('<Q', 1))
-                self._file.write(struct.pack('<Q', K))
                 # reserve the space for total number of chunks
-                self._file.write(struct.pack('<Q', 0))
-                # chunk start
-                self._file.write(struct.pack('<Q', offset))
+                self._file.write(_KNN_HEADER.pack(cls._HDR_MAGIC, 1, K, 0, offset))
                 self.K = K
                 self.count_chunks = 0
                 self.path = path
@@ -112,22 +199,17 @@ class KNNIndex(object):
 
     def __init__(self, path, skip_warmup=True):
         with open(path, 'rb') as stream:
-            magic_test = stream.read(9)
-            assert self._HDR_MAGIC == magic_test, 'Index file doesn\'t match expected format. '
-            version = struct.unpack('<Q', stream.read(8))
-            assert (1,) == version
-
-            self.K = struct.unpack('<Q', stream.read(8))[0]
-            self.len = struct.unpack('<Q', stream.read(8))[0]
-            self.chunk_start_id = struct.unpack('<Q', stream.read(8))[0]
-            self.chunk_end_id = self.chunk_start_id + self.len
-            offset = stream.tell()
+            header = stream.read(_KNN_HEADER.size)
+        assert self._HDR_MAGIC == header[:9], 'Index file doesn\'t match expected format. '
+        _, version, self.K, self.len, self.chunk_start_id = _KNN_HEADER.unpack(header)
+        assert 1 == version
+        self.chunk_end_id = self.chunk_start_id + self.len
+        offset = _KNN_HEADER.size
 
+        self._bin_buffer_mmap = np.memmap(path, mode='r', order='C')
         if not skip_warmup:
             logging.info("    warming up index mmap file...")
-            _warmup_mmap_file(path)
-
-        self._bin_buffer_mmap = np.memmap(path, mode='r', order='C')
+            _warmup_mmap_file(path, self._bin_buffer_mmap)
         self._bin_buffer = memoryview(self._bin_buffer_mmap)
         logging.info("    reading KNN map")
         self.knn_map = np.frombuffer(self._bin_buffer, dtype=np.int64, count=self.len * self.K, offset=offset).reshape(
@@ -192,82 +274,89 @@ class MMapRetrievalIndexedDataset(torch.utils.data.Dataset):
         _HDR_MAGIC = b'MMIDRET\x00\x00'
 
         @classmethod
-        def writer(cls, path, dtype, retrieval_db):
+        def writer(cls, path, dtype, retrieval_db, index_version=1):
+            """
+            index_version: 1 is readable by all releases, 2 stores the chunk ids and addresses
+                in 32 bits and falls back to 1 when they do not fit
+            """
+            if index_version not in (1, 2):
+                raise ValueError(f"unsupported retrieval index version {index_version}")
+
             class _Writer(object):
                 def __enter__(self):
                     self._file = open(path, 'wb')
-
-                    self._file.write(cls._HDR_MAGIC)
-                    # write index file version
-                    self._file.write(struct.pack('<L', 1))
                     return self
 
                 @staticmethod
                 def _get_pointers(sizes, chunk_size):
                     dtype_size = dtype().itemsize
-                    address = 0
-                    pointers = []
-
-                    for size in sizes:
-                        pointers.append(address)
-                        address += size * dtype_size
-                        if retrieval_db:
-                            # if it is retrieval db, the the last chunk is reserved for padding
-                            address += chunk_size * dtype_size
+                    step = np.asarray(sizes, dtype=np.int64) * dtype_size
+                    if retrieval_db:
+                        # if it is retrieval db, the the last chunk is reserved for padding
+                        step += chunk_size * dtype_size
+                    pointers = np.zeros_like(step)
+                    np.cumsum(step[:-1], out=pointers[1:])
                     return pointers
 
                 @staticmethod
-                def _get_chunk_id_and_address(sizes, chunk_size, stride):
+                def _get_chunk_id_and_address(sizes, pointers, chunk_size, stride):
                     if chunk_size % stride != 0:
                         raise ValueError(f"the chunk size {chunk_size} should be the multiple of {stride}")
                     dtype_size = dtype().itemsize
-                    chunk_ids = []
-                    last_id = 0
-                    address = 0
-                    pointers = []
-                    for size in sizes:
-                        chunk_ids.append(last_id)
-                        num_of_chunks = len(range(0, size - chunk_size + 1, stride))
-                        if size % chunk_size != 0:
-                            raise ValueError(f"the document size {size} should be the multiple of {chunk_size}")
-                        for i in range(0, size - chunk_size + 1, stride):
-                            pointers.append(address)
-                            if i == size - chunk_size:
-                                address += chunk_size * dtype_size
-                            else:
-                                address += stride * dtype_size
-                        if retrieval_db:
-                            # if it is retrieval db, the the last chunk is reserved for padding
-                            address += chunk_size * dtype_size
-                        last_id += num_of_chunks
-                    return chunk_ids, pointers
+                    sizes = np.asarray(sizes, dtype=np.int64)
+                    not_aligned = sizes % chunk_size != 0
+                    if not_aligned.any():
+                        size = sizes[np.argmax(not_aligned)]
+                        raise ValueError(f"the document size {size} should be the multiple of {chunk_size}")
+                    # chunks of a document start every `stride` tokens, the last one ends at the document end
+                    num_of_chunks = np.maximum((sizes - chunk_size) // stride + 1, 0)
+                    chunk_ids = np.zeros_like(num_of_chunks)
+                    np.cumsum(num_of_chunks[:-1], out=chunk_ids[1:])
+                    # the chunks of each document start at the document pointer
+                    doc_ids = np.repeat(np.arange(len(sizes)), num_of_chunks)
+                    local_ids = np.arange(len(doc_ids), dtype=np.int64) - chunk_ids[doc_ids]
+                    address = pointers[doc_ids] + local_ids * (stride * dtype_size)
+                    return chunk_ids, address
 
                 def write(self, sizes, chunk_size, stride=64):
                     pointers = self._get_pointers(sizes, chunk_size)
-                    chunk_ids, chunk_address = self._get_chunk_id_and_address(sizes, chunk_size, stride)
-                    # write index chunk stride step
-                    self._file.write(struct.pack('<L', stride))
-                    self._file.write(struct.pack('<B', code(dtype)))
-
-                    self._file.write(struct.pack('<Q', len(sizes)))
-                    self._file.write(struct.pack('<Q', chunk_size))
-                    self._file.write(struct.pack('<Q', len(chunk_address)))
-                    self._file.write(struct.pack('<B', int(retrieval_db)))
-
-                    sizes = np.array(sizes, dtype=np.int32)
-                    self._file.write(sizes.tobytes(order='C'))
-                    del sizes
-
-                    pointers = np.array(pointers, dtype=np.int64)
-                    self._file.write(pointers.tobytes(order='C'))
-                    del pointers
-
-                    chunk_ids = np.array(chunk_ids, dtype=np.int64)
-                    self._file.write(chunk_ids.tobytes(order='C'))
-                    del chunk_ids
-
-                    chunk_address = np.array(chunk_address, dtype=np.int64)
-                    self._file.write(chunk_address.tobytes(order='C'))
+                    chunk_ids, chunk_address = self._get_chunk_id_and_address(sizes, pointers, chunk_size, stride)
+                    version = 1
+                    if index_version == 2:
+                        # version 2 stores the chunk ids as int32 and the chunk addresses as uint32 in units of
+                        # stride tokens, all the chunks start at a multiple of the stride
+                        address_unit = stride * dtype().itemsize
+                        # the chunk addresses are increasing
+                        max_address = (chunk_address[-1] if len(chunk_address) > 0 else 0) // address_unit
+                        # otherwise too large for the compact layout and kept as version 1
+                        if len(chunk_address) < _MAX_COMPACT_CHUNKS and max_address < _MAX_COMPACT_ADDRESS:
+                            version = 2
+                            chunk_ids = chunk_ids.astype(np.int32)
+                            chunk_address = (chunk_address // address_unit).astype(np.uint32)
+                    arrays = [
+                        np.asarray(sizes, dtype=np.int32),
+                        pointers,
+                        chunk_ids,
+                        chunk_address,
+                    ]
+                    offset = _RETRIEVAL_HEADER.size + _RETRIEVAL_META.size
+                    # fill the header and all the arrays into one buffer so the index is emitted in a single write
+                    buffer = np.empty(offset + sum(array.nbytes for array in arrays), dtype=np.uint8)
+                    _RETRIEVAL_HEADER.pack_into(buffer, 0, cls._HDR_MAGIC, version)
+                    _RETRIEVAL_META.pack_into(
+                        buffer,
+                        _RETRIEVAL_HEADER.size,
+                        stride,
+                        code(dtype),
+                        len(sizes),
+                        chunk_size,
+                        len(chunk_address),
+                        int(retrieval_db),
+                    )
+                    for array in arrays:
+                        buffer[offset : offset + array.nbytes].view(array.dtype)[:] = array
+                        offset += array.nbytes
+                    self._file.write(memoryview(buffer))
 
                 def __exit__(self, exc_type, exc_val, exc_tb):
                     self._file.close()
@@ -275,73 +364,88 @@ class MMapRetrievalIndexedDataset(torch.utils.data.Dataset):
             return _Writer()
 
         def __init__(self, path, skip_warmup=True):
+            self._path = path
+            offset = _RETRIEVAL_HEADER.size + _RETRIEVAL_META.size
             with open(path, 'rb') as stream:
-                magic_test = stream.read(9)
-                assert self._HDR_MAGIC == magic_test, (
-                    'Index file doesn\'t match expected format. '
-                    'Make sure that --dataset-impl is configured properly.'
-                )
-                version = struct.unpack('<L', stream.read(4))
-                assert (1,) == version
-                # load the stride size
-                (self.stride,) = struct.unpack('<L', stream.read(4))
-                # for legacy compatibility
-                if self.stride == 0:
-                    self.stride = 64
-
-                (dtype_code,) = struct.unpack('<B', stream.read(1))
-                self._dtype = dtypes[dtype_code]
-                self._dtype_size = self._dtype().itemsize
-
-                self._len = struct.unpack('<Q', stream.read(8))[0]
-                self.chunk_size = struct.unpack('<Q', stream.read(8))[0]
-                self.num_chunks = struct.unpack('<Q', stream.read(8))[0]
-                self.retrieval_db = bool(struct.unpack('<B', stream.read(1))[0])
-                # self.chunk_size = struct.unpack('<Q', stream.read(8))[0]
-                # self.num_chunks = struct.unpack('<Q', stream.read(8))[0]
-                offset = stream.tell()
+                header = stream.read(offset)
+            assert self._HDR_MAGIC == header[:9], (
+                'Index file doesn\'t match expected format. '
+                'Make sure that --dataset-impl is configured properly.'
+            )
+            _, version = _RETRIEVAL_HEADER.unpack_from(header)
+            assert version in (1, 2)
+            (
+                self.stride,
+                dtype_code,
+                self._len,
+                self.chunk_size,
+                self.num_chunks,
+                retrieval_db,
+            ) = _RETRIEVAL_META.unpack_from(header, _RETRIEVAL_HEADER.size)
+            # for legacy compatibility
+            if self.stride == 0:
+                self.stride = 64
+            # the stride is usually a power of two, so the chunk offset is a shift instead of a division
+            self._stride_shift = self.stride.bit_length() - 1 if self.stride & (self.stride - 1) == 0 else None
+            self._dtype = dtypes[dtype_code]
+            self._dtype_size = self._dtype().itemsize
+            self.retrieval_db = bool(retrieval_db)
+            if version == 1:
+                chunk_id_dtype, chunk_address_dtype = np.int64, np.int64
+                self._chunk_address_unit = 1
+            else:
+                chunk_id_dtype, chunk_address_dtype = np.int32, np.uint32
+                self._chunk_address_unit = self.stride * self._dtype_size
 
+            self._bin_buffer_mmap = np.memmap(path, mode='r', order='C')
             if not skip_warmup:
                 logging.info("    warming up index mmap file...")
-                _warmup_mmap_file(path)
-
-            self._bin_buffer_mmap = np.memmap(path, mode='r', order='C')
+                _warmup_mmap_file(path, self._bin_buffer_mmap)
             self._bin_buffer = memoryview(self._bin_buffer_mmap)
-            logging.info("    reading document sizes...")
-            self._sizes = np.frombuffer(self._bin_buffer, dtype=np.int32, count=self._len, offset=offset)
-            logging.info("    reading document pointers...")
-            self._pointers = np.frombuffer(
-                self._bin_buffer, dtype=np.int64, count=self._len, offset=offset + self._sizes.nbytes
-            )
-            logging.info("    reading document chunk offset...")
-            self._chunk_id_start = np.frombuffer(
-                self._bin_buffer,
-                dtype=np.int64,
-                count=self._len,
-                offset=offset + self._sizes.nbytes + self._pointers.nbytes,
+            logging.info("    reading document sizes, pointers, chunk offsets and chunk addresses...")
+            self._sizes = np.ndarray(shape=(self._len,), dtype=np.int32, buffer=self._bin_buffer, offset=offset)
+            offset += self._sizes.nbytes
+            self._pointers = np.ndarray(shape=(self._len,), dtype=np.int64, buffer=self._bin_buffer, offset=offset)
+            offset += self._pointers.nbytes
+            self._chunk_id_start = np.ndarray(
+                shape=(self._len,), dtype=chunk_id_dtype, buffer=self._bin_buffer, offset=offset
             )
-            logging.info("    reading chunk address...")
-            self._chunk_address = np.frombuffer(
-                self._bin_buffer,
-                dtype=np.int64,
-                count=self.num_chunks,
-                offset=offset + self._sizes.nbytes + self._pointers.nbytes + self._chunk_id_start.nbytes,
+            offset += self._chunk_id_start.nbytes
+            # in units of `_chunk_address_unit` bytes
+            self._chunk_address = np.ndarray(
+                shape=(self.num_chunks,), dtype=chunk_address_dtype, buffer=self._bin_buffer, offset=offset
             )
 
         def get_chunk_address(self, chunk_id):
-            """ get the chunk address from chunk id
+            """ get the chunk address (in bytes) from chunk id or a slice of chunk ids
             """
-            return self._chunk_address[chunk_id]
+            return self._chunk_address[chunk_id].astype(np.int64) * self._chunk_address_unit
 
         def get_chunk_id(self, sentence_id, position):
             """ get the chunk id from sentence idx and offset position.
             """
-            chunk_offset = position // self.stride
+            if self._stride_shift is not None:
+                chunk_offset = position >> self._stride_shift
+            else:
+                chunk_offset = position // self.stride
             size = self._sizes[sentence_id]
             if chunk_offset * self.stride >= size:
                 raise ValueError('offset is too large')
             return (self._chunk_id_start[sentence_id] + chunk_offset).item()
 
+        def get_chunk_ids(self, sentence_ids, positions):
+            """ get the chunk ids from arrays of sentence idx and offset positions.
+            """
+            sentence_ids = np.asarray(sentence_ids)
+            positions = np.asarray(positions, dtype=np.int64)
+            if self._stride_shift is not None:
+                chunk_offsets = positions >> self._stride_shift
+            else:
+                chunk_offsets = positions // self.stride
+            if (chunk_offsets * self.stride >= self._sizes[sentence_ids]).any():
+                raise ValueError('offset is too large')
+            return self._chunk_id_start[sentence_ids] + chunk_offsets
+
         def from_chunk_id_to_doc_id(self, chunk_id):
             """ from chunk_id, calculate the document id
             """
@@ -350,9 +454,21 @@ class MMapRetrievalIndexedDataset(torch.utils.data.Dataset):
             doc_id = np.searchsorted(self._chunk_id_start, chunk_id, side='right')
             return doc_id - 1
 
-        def __del__(self):
+        def close(self, drop_cache=False):
+            """
+            Close the index mmap.
+            drop_cache: also hint the kernel to evict the file from the page cache, e.g. when cycling
+                through datasets larger than memory. Leave it off if the file is opened again soon.
+            """
+            if getattr(self, '_bin_buffer_mmap', None) is None:
+                return
             self._bin_buffer_mmap._mmap.close()
-            del self._bin_buffer_mmap
+            self._bin_buffer_mmap = None
+            if drop_cache:
+                _drop_page_cache(self._path)
+
+        def __del__(self):
+            self.close()
 
         @property
         def dtype(self):
@@ -368,7 +484,6 @@ class MMapRetrievalIndexedDataset(torch.utils.data.Dataset):
             """
             return self._sizes
 
-        @lru_cache(maxsize=8)
         def __getitem__(self, i):
             """
             return a single document staring address (in bytes) and number of tokens
@@ -390,25 +505,51 @@ class MMapRetrievalIndexedDataset(torch.utils.data.Dataset):
     def __getstate__(self):
         return self._path
 
-    # def __setstate__(self, state):
-    #     self._do_init(state)
+    def __setstate__(self, state):
+        # the pages were already warmed up by the process that pickled the dataset
+        self._do_init(state, skip_warmup=True)
 
     def _do_init(self, path, skip_warmup):
         self._path = path
         self._index = self.Index(index_file_path(self._path), skip_warmup)
 
-        if not skip_warmup:
-            logging.info("    warming up data mmap file...")
-            _warmup_mmap_file(data_file_path(self._path))
         logging.info("    creating numpy buffer of mmap...")
         self._bin_buffer_mmap = np.memmap(data_file_path(self._path), mode='r', order='C')
+        if not skip_warmup:
+            logging.info("    warming up data mmap file...")
+            _warmup_mmap_file(data_file_path(self._path), self._bin_buffer_mmap)
         logging.info("    creating memory view of numpy buffer...")
         self._bin_buffer = memoryview(self._bin_buffer_mmap)
+        # bind the index attributes used on the per-item access paths
+        self._dtype = self._index.dtype
+        self._dtype_size = self._index._dtype_size
+        self._pointers = self._index._pointers
+        self._sizes = self._index._sizes
+        self._chunk_size = self._index.chunk_size
+        self._retrieval_db = self._index.retrieval_db
+        self._chunk_address = self._index._chunk_address
+        self._chunk_address_unit = self._index._chunk_address_unit
+        # retrieval db chunks are read together with their continuation chunk
+        self._chunk_read_size = self._chunk_size * 2 if self._retrieval_db else self._chunk_size
+
+    def close(self, drop_cache=False):
+        """
+        Close the data and index mmaps.
+        drop_cache: also hint the kernel to evict both files from the page cache, e.g. when cycling
+            through datasets larger than memory. Leave it off if the files are opened again soon,
+            such as a job resuming on the same node.
+        """
+        if getattr(self, '_bin_buffer_mmap', None) is None:
+            return
+        self._bin_buffer_mmap._mmap.close()
+        self._bin_buffer_mmap = None
+        self._index.close(drop_cache)
+        self._index = None
+        if drop_cache:
+            _drop_page_cache(data_file_path(self._path))
 
     def __del__(self):
-        self._bin_buffer_mmap._mmap.close()
-        del self._bin_buffer_mmap
-        del self._index
+        self.close()
 
     def __len__(self):
         """
@@ -416,35 +557,27 @@ class MMapRetrievalIndexedDataset(torch.utils.data.Dataset):
         """
         return len(self._index)
 
-    # @lru_cache(maxsize=8)
     def __getitem__(self, idx):
         """
         return a single document or a slice of documents, excluding the paddings for the retrieval db
         """
         if isinstance(idx, int):
             # no need to handle retrieval_db since size exclude the paddings
-            ptr, size = self._index[idx]
-            np_array = np.frombuffer(self._bin_buffer, dtype=self._index.dtype, count=size, offset=ptr)
+            ptr = self._pointers[idx]
+            size = self._sizes[idx]
+            np_array = np.frombuffer(self._bin_buffer, dtype=self._dtype, count=size, offset=ptr)
             return np_array
         elif isinstance(idx, slice):
             start, stop, step = idx.indices(len(self))
             if step != 1:
                 raise ValueError("Slices into indexed_dataset must be contiguous")
-            ptr = self._index._pointers[start]
-            if self._index.retrieval_db:
-                # for retrieval db, need to add the padding of chunk_size at the end of each document
-                sizes = self._index._sizes[idx] + self._index.chunk_size
-            else:
-                sizes = self._index._sizes[idx]
-            # offsets get the number of tokens for each document including the paddings
-            offsets = list(accumulate(sizes))
-            total_size = sum(sizes)
-            np_array = np.frombuffer(self._bin_buffer, dtype=self._index.dtype, count=total_size, offset=ptr)
-            sents = np.split(np_array, offsets[:-1])
-            if self._index.retrieval_db:
-                # remove the paddings
-                sents = [sent[: -self._index.chunk_size] for sent in sents]
-            return sents
+            # the sizes exclude the retrieval db paddings, so each document is a view at its own pointer
+            pointers = self._pointers[start:stop].tolist()
+            sizes = self._sizes[start:stop].tolist()
+            return [
+                np.frombuffer(self._bin_buffer, dtype=self._dtype, count=size, offset=ptr)
+                for ptr, size in zip(pointers, sizes)
+            ]
 
     def get(self, idx, offset=0, length=None):
         """ Retrieves a single item from the dataset with the option to only
@@ -453,20 +586,28 @@ class MMapRetrievalIndexedDataset(torch.utils.data.Dataset):
         get(idx) is the same as [idx] but get() does not support slicing.
         """
         # no need to handle retrieval_db since size exclude the paddings
-        ptr, size = self._index[idx]
+        ptr = self._pointers[idx]
+        size = self._sizes[idx]
         if length is None:
             length = size - offset
-        ptr += offset * np.dtype(self._index.dtype).itemsize
-        np_array = np.frombuffer(self._bin_buffer, dtype=self._index.dtype, count=length, offset=ptr)
+        ptr += offset * self._dtype_size
+        np_array = np.frombuffer(self._bin_buffer, dtype=self._dtype, count=length, offset=ptr)
         return np_array
 
     def get_chunk_id(self, idx, offset=0):
         """ get the chunk id from document idx and offset position.
         """
         # make sure offset is a multiple of chunk_size
-        assert offset % self._index.chunk_size == 0
+        assert offset % self._chunk_size == 0
         return self._index.get_chunk_id(idx, offset)
 
+    def get_chunk_ids(self, idx, offset):
+        """ get the chunk ids from arrays of document idx and offset positions.
+        """
+        # make sure offsets are multiples of chunk_size
+        assert not (np.asarray(offset) % self._chunk_size).any()
+        return self._index.get_chunk_ids(idx, offset)
+
     def from_chunk_id_to_doc_id(self, chunk_id):
         """ from chunk_id, calculate the document id
         """
@@ -479,29 +620,22 @@ class MMapRetrievalIndexedDataset(torch.utils.data.Dataset):
         If force_no_cont_ids=True, it will always get chunk_size tokens
         """
         if isinstance(chunk_id, (int, np.int64, np.int32)):
-            ptr = self._index.get_chunk_address(chunk_id)
-            if self._index.retrieval_db and (not force_no_cont_ids):
-                size = self._index.chunk_size * 2
-            else:
-                size = self._index.chunk_size
-            np_array = np.frombuffer(self._bin_buffer, dtype=self._index.dtype, count=size, offset=ptr)
-            return np_array
+            size = self._chunk_size if force_no_cont_ids else self._chunk_read_size
+            ptr = int(self._chunk_address[chunk_id]) * self._chunk_address_unit
+            return np.frombuffer(self._bin_buffer, dtype=self._dtype, count=size, offset=ptr)
         elif isinstance(chunk_id, slice):
             start, stop, step = chunk_id.indices(self.chunks)
             if step != 1:
                 raise ValueError("Slices into indexed_dataset must be contiguous")
-            if self._index.retrieval_db and (not force_no_cont_ids):
-                chunk_size = self._index.chunk_size * 2
-            else:
-                chunk_size = self._index.chunk_size
-            ptr = self._index.get_chunk_address(start)
-            end_address = self._index.get_chunk_address(stop - 1) + chunk_size * self._index._dtype_size
-            address = self._index._chunk_address[chunk_id]
-            starting_pos = address // self._index._dtype_size
-            total_size = (end_address - ptr) // self._index._dtype_size
-            np_array = np.frombuffer(self._bin_buffer, dtype=self._index.dtype, count=total_size, offset=ptr)
-            sents = [np_array[pos : pos + chunk_size] for pos in starting_pos - starting_pos[0]]
-            return sents
+            chunk_size = self._chunk_size if force_no_cont_ids else self._chunk_read_size
+            address = self._index.get_chunk_address(slice(start, stop))
+            if len(address) == 0:
+                return []
+            # token offsets of each chunk relative to the first one, converted to python ints once
+            offsets = ((address - address[0]) // self._dtype_size).tolist()
+            total_size = offsets[-1] + chunk_size
+            np_array = np.frombuffer(self._bin_buffer, dtype=self._dtype, count=total_size, offset=address[0])
+            return [np_array[pos : pos + chunk_size] for pos in offsets]
 
     @property
     def sizes(self):
@@ -533,15 +667,56 @@ class MMapRetrievalIndexedDataset(torch.utils.data.Dataset):
         return os.path.exists(index_file_path(path)) and os.path.exists(data_file_path(path))
 
 
+class _GrowableArray(object):
+    """
+    Append-only numpy array that doubles its capacity when full.
+    It stores one fixed size item per entry instead of a python object.
+    """
+
+    def __init__(self, dtype, capacity=1024):
+        self._buffer = np.empty(capacity, dtype=dtype)
+        self._len = 0
+
+    def _reserve(self, size):
+        if size > len(self._buffer):
+            buffer = np.empty(max(size, 2 * len(self._buffer)), dtype=self._buffer.dtype)
+            buffer[: self._len] = self._buffer[: self._len]
+            self._buffer = buffer
+
+    def append(self, value):
+        self._reserve(self._len + 1)
+        self._buffer[self._len] = value
+        self._len += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._buffer.dtype)
+        self._reserve(self._len + len(values))
+        self._buffer[self._len : self._len + len(values)] = values
+        self._len += len(values)
+
+    @property
+    def array(self):
+        """
+        view of the appended items
+        """
+        return self._buffer[: self._len]
+
+    def __len__(self):
+        return self._len
+
+
 class MMapRetrievalIndexedDatasetBuilder(object):
-    def __init__(self, out_file, chunk_size, pad_id, retrieval_db=False, dtype=np.int64, stride=64):
+    def __init__(self, out_file, chunk_size, pad_id, retrieval_db=False, dtype=np.int64, stride=64, index_version=1):
         self._data_file = open(out_file, 'wb')
         self._dtype = dtype
         self.chunk_size = chunk_size
-        self._sizes = []
+        self._sizes = _GrowableArray(np.int32)
         self.retrieval_db = retrieval_db
         self.pad_id = pad_id
         self.stride = stride
+        self.index_version = index_version
+        # shared padding tail, at most one chunk plus the retrieval db padding chunk
+        self._pad_buffer = np.full(chunk_size * 2, pad_id, dtype=dtype)
 
     def add_item(self, tensor):
         """
@@ -549,14 +724,15 @@ class MMapRetrievalIndexedDatasetBuilder(object):
         It will pad the tokens to be the multiple of chunk_size.
         If it is retrieval dataset, it will pad extra chunk_size tokens at the end of the document.
         """
-        np_array = np.array(tensor.numpy(), dtype=self._dtype)
+        np_array = np.ascontiguousarray(tensor.numpy(), dtype=self._dtype)
         padded_size = self.chunk_size - (len(np_array) % self.chunk_size)
         data_size = np_array.size + padded_size
         if self.retrieval_db:
             # for retrieval database, added one more chunk in the end as padding
             padded_size += self.chunk_size
-        np_array = np.pad(np_array, (0, padded_size), 'constant', constant_values=self.pad_id)
-        self._data_file.write(np_array.tobytes(order='C'))
+        # write the tokens and the padding tail separately to avoid materializing the padded copy
+        self._data_file.write(memoryview(np_array))
+        self._data_file.write(memoryview(self._pad_buffer[:padded_size]))
         self._sizes.append(data_size)
 
     def end_document(self):
@@ -570,12 +746,30 @@ class MMapRetrievalIndexedDatasetBuilder(object):
         index = MMapRetrievalIndexedDataset.Index(index_file_path(another_file))
         assert index.dtype == self._dtype
 
-        for size in index.sizes:
-            self._sizes.append(size)
+        self._sizes.extend(index.sizes)
 
         # Concatenate data
         with open(data_file_path(another_file), 'rb') as f:
-            shutil.copyfileobj(f, self._data_file)
+            # copy inside the kernel on Linux, other platforms only sendfile to sockets
+            if sys.platform.startswith('linux'):
+                # the buffered writes must reach the file first
+                self._data_file.flush()
+                size = os.fstat(f.fileno()).st_size
+                offset = 0
+                try:
+                    while offset < size:
+                        sent = os.sendfile(self._data_file.fileno(), f.fileno(), offset, size - offset)
+                        if sent == 0:
+                            break
+                        offset += sent
+                except OSError:
+                    # not supported for these files
+                    pass
+                if offset == size:
+                    return
+                # copy the rest through a buffer
+                f.seek(offset)
+            shutil.copyfileobj(f, self._data_file, length=8 * 1024 * 1024)
 
     def finalize(self, index_file):
         """
@@ -585,5 +779,7 @@ class MMapRetrievalIndexedDatasetBuilder(object):
         """
         self._data_file.close()
 
-        with MMapRetrievalIndexedDataset.Index.writer(index_file, self._dtype, self.retrieval_db) as index:
-            index.write(self._sizes, self.chunk_size, stride=self.stride)
+        with MMapRetrievalIndexedDataset.Index.writer(
+            index_file, self._dtype, self.retrieval_db, index_version=self.index_version
+        ) as index:
+            index.write(self._sizes.array, self.chunk_size, stride=self.stride)
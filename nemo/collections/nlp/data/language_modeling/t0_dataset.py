@@ -16,7 +16,7 @@ import torch
 
 from nemo.collections.common.tokenizers.tokenizer_spec import TokenizerSpec
 from nemo.collections.nlp.data.language_modeling.megatron.dataset_utils import get_samples_mapping
-from nemo.collections.nlp.data.language_modeling.text_memmap_dataset import JSONLMemMapDataset, TextMemMapDataset
+from nemo.collections.nlp.data.language_modeling.text_memmap_dataset import JSONLMemMapDataset
 from nemo.core.classes import Dataset
 
 
@@ -120,11 +120,12 @@ class T0Dataset(Dataset):
             tokenized_output = tokenized_output[: self.max_tgt_seq_length - 2]
 
         bos_id = self.tokenizer.pad_id if self.replace_bos_with_pad else self.tokenizer.bos_id
+        eos_id = self.tokenizer.eos_id
         if self.add_bos_to_input:
             tokenized_input = [bos_id] + tokenized_input
         if self.add_eos_to_input:
-            tokenized_input = tokenized_input + [self.tokenizer.eos_id]
-        target = [bos_id] + tokenized_output + [self.tokenizer.eos_id]
+            tokenized_input = tokenized_input + [eos_id]
+        target = [bos_id] + tokenized_output + [eos_id]
 
         processed_example = {
             'text_enc': tokenized_input,
@@ -134,20 +135,20 @@ class T0Dataset(Dataset):
 
         # Process optional args:
         if 'chunked_idx' in example:
-            original = ""
-            template = ""
+            original = []
+            template = []
             for item in example['chunked_idx'].split(', '):
                 item = item.split('-')
                 if item[0] == "original_text":
-                    original += example['input'][int(item[1]) : int(item[2])]
+                    original.append(example['input'][int(item[1]) : int(item[2])])
                 elif item[0] == "template":
-                    template += example['input'][int(item[1]) : int(item[2])]
+                    template.append(example['input'][int(item[1]) : int(item[2])])
                 else:
                     raise ValueError(f"Unknown chunk type: {item[0]}")
 
             additional_args = {
-                'original': self.tokenizer.text_to_ids(original),
-                'template': self.tokenizer.text_to_ids(template),
+                'original': self.tokenizer.text_to_ids("".join(original)),
+                'template': self.tokenizer.text_to_ids("".join(template)),
                 'prompt': self.tokenizer.text_to_ids(example['prompt']),
             }
             processed_example.update(additional_args)
@@ -166,31 +167,31 @@ class T0Dataset(Dataset):
 
         return processed_example
 
-    def _maybe_cast_to_list(self, x):
-        if isinstance(x, np.ndarray):
-            return [item.tolist() for item in x]
-        return x
-
     def _collate_item(self, item):
-        item = self._maybe_cast_to_list(item)
-        max_length = max([len(x) for x in item]) if item else 0
-        item = [x + [self.tokenizer.pad_id] * (max_length - len(x)) for x in item]
-        return item
+        """
+        Pad a list of token id sequences into a single int64 array.
+        """
+        lengths = [len(x) for x in item]
+        max_length = max(lengths) if lengths else 0
+        collated = np.full((len(item), max_length), self.tokenizer.pad_id, dtype=np.int64)
+        for i, (x, length) in enumerate(zip(item, lengths)):
+            collated[i, :length] = x
+        return collated
 
     def collate_fn(self, batch):
         enc_query = [item['text_enc'] for item in batch]
         dec_input = [item['text_dec'] for item in batch]
         labels = [item['labels'] for item in batch]
 
-        enc_query = torch.LongTensor(self._collate_item(enc_query))
-        dec_input = torch.LongTensor(self._collate_item(dec_input))
-        loss_mask = torch.LongTensor(
-            [([1] * (len(item))) + ([0] * (dec_input.size(1) - len(item))) for item in labels]
-        )
-        labels = torch.LongTensor(self._collate_item(labels))
+        enc_query = torch.from_numpy(self._collate_item(enc_query))
+        dec_input = torch.from_numpy(self._collate_item(dec_input))
+        label_lengths = np.array([len(item) for item in labels])
+        loss_mask = torch.from_numpy((np.arange(dec_input.size(1)) < label_lengths[:, None]).astype(np.int64))
+        labels = torch.from_numpy(self._collate_item(labels))
 
-        enc_mask = (enc_query != self.tokenizer.pad_id).long()
-        dec_mask = (dec_input != self.tokenizer.pad_id).long()
+        pad_id = self.tokenizer.pad_id
+        enc_mask = (enc_query != pad_id).long()
+        dec_mask = (dec_input != pad_id).long()
 
         processed_example = {
             'text_enc': enc_query,
@@ -204,18 +205,18 @@ class T0Dataset(Dataset):
         # Collate additional args if present in the batch.
         if 'original' in batch[0]:
             original = self._collate_item([item['original'] for item in batch])
-            processed_example['original'] = torch.LongTensor(original)
+            processed_example['original'] = torch.from_numpy(original)
 
         if 'template' in batch[0]:
             template = self._collate_item([item['template'] for item in batch])
-            processed_example['template'] = torch.LongTensor(template)
+            processed_example['template'] = torch.from_numpy(template)
 
         if 'prompt' in batch[0]:
             prompt = self._collate_item([item['prompt'] for item in batch])
-            processed_example['prompt'] = torch.LongTensor(prompt)
+            processed_example['prompt'] = torch.from_numpy(prompt)
 
         if 'task_name_with_prompt' in batch[0]:
             task_name_with_prompt = self._collate_item([item['task_name_with_prompt'] for item in batch])
-            processed_example['task_name_with_prompt'] = torch.LongTensor(task_name_with_prompt)
+            processed_example['task_name_with_prompt'] = torch.from_numpy(task_name_with_prompt)
 
         return processed_example
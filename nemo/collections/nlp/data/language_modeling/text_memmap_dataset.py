@@ -14,6 +14,7 @@
 
 import datetime
 import json
+import mmap
 import multiprocessing as mp
 import os
 import pickle
@@ -30,6 +31,7 @@ from nemo.utils import AppState, logging
 __all__ = ["TextMemMapDataset", "CSVMemMapDataset", "build_index_files"]
 __idx_version__ = "0.2"  # index file version
 __idx_suffix__ = "idx"  # index file suffix
+_INDEX_SCAN_CHUNK = 64 * 1024 * 1024  # bytes scanned per step when building an index
 
 
 def _build_index_from_memdata(fn, newline_int):
@@ -41,19 +43,24 @@ def _build_index_from_memdata(fn, newline_int):
     """
     # use memmap to read file
     mdata = np.memmap(fn, dtype=np.uint8, mode="r")
-    # find newline positions
-    midx = np.where(mdata == newline_int)[0]
-    midx_dtype = midx.dtype
-    # make sure to account for all data
-    midx = midx.tolist()
+    # the file is scanned once front to back, let the kernel read ahead aggressively
+    try:
+        mdata._mmap.madvise(mmap.MADV_SEQUENTIAL)
+    except (AttributeError, OSError):
+        pass
+    # find newline positions, in chunks to bound the size of the temporary boolean mask
+    midx = [
+        np.flatnonzero(mdata[start : start + _INDEX_SCAN_CHUNK] == newline_int) + start
+        for start in range(0, len(mdata), _INDEX_SCAN_CHUNK)
+    ]
+    midx = np.concatenate(midx) if midx else np.empty(0, dtype=np.intp)
     # add last item in case there is no new-line at the end of the file
     if (len(midx) == 0) or (midx[-1] + 1 != len(mdata)):
-        midx = midx + [len(mdata) + 1]
+        midx = np.append(midx, len(mdata) + 1)
 
     # remove empty lines from end of file
-    while len(midx) > 1 and (midx[-1] - midx[-2]) < 2:
-        midx.pop(-1)
-    midx = np.asarray(midx, dtype=midx_dtype)
+    last = np.flatnonzero(np.diff(midx) >= 2)
+    midx = midx[: last[-1] + 2] if len(last) else midx[:1]
 
     # free memmap
     mdata._mmap.close()
@@ -218,6 +218,7 @@ class MegatronT0Model(MegatronT5SFTModel):
             collate_fn=collate_fn,
             num_workers=data_cfg.num_workers,
             pin_memory=data_cfg.pin_memory,
+            persistent_workers=True if data_cfg.num_workers > 0 else False,
         )
 
     def setup_training_dataloader(self):
@@ -236,6 +236,13 @@ def get_args():
     group = parser.add_argument_group(title='output data')
     group.add_argument('--output-prefix', type=str, required=True, help='Path to binary output file without suffix')
     group.add_argument('--dataset-impl', type=str, default='mmap', choices=['lazy', 'cached', 'mmap', 'retmmap'])
+    group.add_argument(
+        '--retrieval-index-version',
+        type=int,
+        default=1,
+        choices=[1, 2],
+        help='retmmap index format, 2 is more compact but cannot be read by older releases',
+    )
 
     group = parser.add_argument_group(title='runtime')
     group.add_argument('--workers', type=int, default=1, help='Number of worker processes to launch')
@@ -313,6 +320,7 @@ def main():
             retrieval_db=args.retrieval_db,
             vocab_size=tokenizer.vocab_size,
             stride=args.chunk_stride_size,
+            index_version=args.retrieval_index_version,
         )
 
     startup_end = time.time()
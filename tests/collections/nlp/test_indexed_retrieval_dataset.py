@@ -14,6 +14,7 @@
 
 
 import os
+import pickle
 
 import numpy as np
 import pytest
@@ -22,6 +23,7 @@ from numpy.testing import assert_array_equal
 from omegaconf import OmegaConf
 from scripts.nlp_language_modeling.build_knn_map_index import build_map, dedup
 
+from nemo.collections.nlp.data.language_modeling.megatron import indexed_retrieval_dataset
 from nemo.collections.nlp.data.language_modeling.megatron.indexed_retrieval_dataset import (
     KNNIndex,
     MMapRetrievalIndexedDataset,
@@ -76,7 +78,7 @@ class TestRetrievalIndexFiles:
             start = max(add1) + chunk_size * itemsize
             add2 = [i * itemsize + start for i in list(range(0, sizes[1] - chunk_size + 1, stride))]
             addr = add1 + add2
-            assert np.array_equal(index_load._chunk_address, np.array(addr, dtype=np.int64))
+            assert np.array_equal(index_load.get_chunk_address(slice(None)), np.array(addr, dtype=np.int64))
             assert np.array_equal(index_load._pointers, np.array([0, sizes[0] * itemsize], dtype=np.int64))
             assert len(index_load._chunk_address) == index_load.num_chunks
         finally:
@@ -104,7 +106,7 @@ class TestRetrievalIndexFiles:
             start = max(add1) + chunk_size * itemsize
             add2 = [i * itemsize + start for i in list(range(0, sizes[1] - chunk_size + 1, stride))]
             addr = add1 + add2
-            assert np.array_equal(index_load._chunk_address, np.array(addr, dtype=np.int64))
+            assert np.array_equal(index_load.get_chunk_address(slice(None)), np.array(addr, dtype=np.int64))
             assert np.array_equal(index_load._pointers, np.array([0, sizes[0] * itemsize], dtype=np.int64))
             assert len(index_load._chunk_address) == index_load.num_chunks
         finally:
@@ -168,10 +170,98 @@ class TestRetrievalIndexFiles:
             assert ds.get_chunk_id(1, 192) == 9
             with pytest.raises(ValueError):
                 ds.get_chunk_id(0, 256)
+            assert np.array_equal(ds.get_chunk_ids([0, 1, 1, 1, 1], [64, 0, 64, 128, 192]), [2, 3, 5, 7, 9])
+            with pytest.raises(ValueError):
+                ds.get_chunk_ids([1, 0], [0, 128])
         finally:
             os.remove(index_file)
             os.remove(bin_file)
 
+    @pytest.mark.unit
+    def test_get_chunk_ids(self):
+        # the stride of 24 is not a power of two
+        for chunk_size, stride in [(64, 32), (64, 16), (48, 24)]:
+            sizes = np.array([chunk_size * 2, chunk_size * 5, chunk_size], dtype=np.int32)
+            index_file = '/tmp/test.idx'
+            try:
+                with MMapRetrievalIndexedDataset.Index.writer(index_file, np.int64, False) as index:
+                    index.write(sizes, chunk_size, stride=stride)
+
+                index_load = MMapRetrievalIndexedDataset.Index(index_file)
+                sentence_ids = np.concatenate([np.full(size // stride, i) for i, size in enumerate(sizes)])
+                positions = np.concatenate([np.arange(0, size, stride) for size in sizes])
+                chunk_ids = [index_load.get_chunk_id(i, position) for i, position in zip(sentence_ids, positions)]
+                assert np.array_equal(index_load.get_chunk_ids(sentence_ids, positions), chunk_ids)
+                with pytest.raises(ValueError):
+                    index_load.get_chunk_id(0, sizes[0])
+                with pytest.raises(ValueError):
+                    index_load.get_chunk_ids(sentence_ids, positions + stride)
+            finally:
+                os.remove(index_file)
+
+    @pytest.mark.unit
+    def test_index_versions(self, monkeypatch):
+        chunk_size = 64
+        pad_id = 0
+        stride = 32
+        sentence1 = torch.arange(0, 200, 2, dtype=torch.int64)
+        sentence2 = torch.arange(1, 500, 2, dtype=torch.int64)
+
+        data_file = '/tmp/test'
+        merged_file = '/tmp/test_merged'
+        fallback_index_file = '/tmp/test_fallback.idx'
+        try:
+            # version 1 is written by default
+            builder = MMapRetrievalIndexedDatasetBuilder(
+                data_file + '.bin', chunk_size, pad_id, False, dtype=np.int64, stride=stride
+            )
+            builder.add_item(sentence1)
+            builder.add_item(sentence2)
+            builder.finalize(data_file + '.idx')
+            # a version 1 index can be merged into a version 2 one
+            builder = MMapRetrievalIndexedDatasetBuilder(
+                merged_file + '.bin', chunk_size, pad_id, False, dtype=np.int64, stride=stride, index_version=2
+            )
+            builder.merge_file_(data_file)
+            builder.merge_file_(data_file)
+            builder.finalize(merged_file + '.idx')
+            assert np.fromfile(data_file + '.idx', dtype='<u4', count=1, offset=9)[0] == 1
+            assert np.fromfile(merged_file + '.idx', dtype='<u4', count=1, offset=9)[0] == 2
+            # indices too large for the compact version 2 layout are written as version 1
+            with monkeypatch.context() as m:
+                m.setattr(indexed_retrieval_dataset, '_MAX_COMPACT_ADDRESS', 0)
+                with MMapRetrievalIndexedDataset.Index.writer(fallback_index_file, np.int64, False, 2) as index:
+                    index.write(np.array([128, 256], dtype=np.int32), chunk_size, stride=stride)
+            with open(fallback_index_file, 'rb') as f1, open(data_file + '.idx', 'rb') as f2:
+                assert f1.read() == f2.read()
+            with pytest.raises(ValueError):
+                MMapRetrievalIndexedDataset.Index.writer(fallback_index_file, np.int64, False, 3)
+
+            ds = MMapRetrievalIndexedDataset(data_file)
+            merged = MMapRetrievalIndexedDataset(merged_file)
+            assert len(merged) == 2 * len(ds)
+            assert merged.chunks == 2 * ds.chunks
+            # chunks start every stride tokens, documents are 128 and 256 tokens long
+            addr = np.array([0, 32, 64] + list(range(128, 384 - chunk_size + 1, stride)), dtype=np.int64) * 8
+            assert np.array_equal(ds._index.get_chunk_address(slice(None)), addr)
+            assert np.array_equal(merged._index.get_chunk_address(slice(None)), np.concatenate([addr, addr + 384 * 8]))
+            for i in range(len(ds)):
+                for offset in range(0, ds.sizes[i], chunk_size):
+                    chunk_id = ds.get_chunk_id(i, offset)
+                    assert merged.get_chunk_id(i + len(ds), offset) == chunk_id + ds.chunks
+                    assert np.array_equal(ds.get_chunk(chunk_id), ds[i][offset : offset + chunk_size])
+                    assert np.array_equal(merged.get_chunk(chunk_id + ds.chunks), ds.get_chunk(chunk_id))
+            with pytest.raises(ValueError):
+                ds.get_chunk_id(0, 128)
+            multi_chunks = ds.get_chunk(slice(0, ds.chunks))
+            for chunk_id in range(ds.chunks):
+                assert np.array_equal(multi_chunks[chunk_id], ds.get_chunk(chunk_id))
+        finally:
+            for prefix in (data_file, merged_file):
+                os.remove(prefix + '.idx')
+                os.remove(prefix + '.bin')
+            os.remove(fallback_index_file)
+
     @pytest.mark.unit
     def test_create_data_index(self):
         chunk_size = 64
@@ -223,6 +313,15 @@ class TestRetrievalIndexFiles:
             assert ds.get_chunk_id(1, 192) == 5
             with pytest.raises(ValueError):
                 ds.get_chunk_id(0, 256)
+            # the dataset is pickled by path and reopened, e.g. for DataLoader workers
+            ds_copy = pickle.loads(pickle.dumps(ds))
+            assert len(ds_copy) == len(ds)
+            assert np.array_equal(ds_copy.get(1), gt2)
+            assert np.array_equal(ds_copy.get_chunk(chunk_id + 1), gt2[64:128])
+            # closing one copy leaves the other usable, closing twice is harmless
+            ds_copy.close(drop_cache=True)
+            ds_copy.close()
+            assert np.array_equal(ds.get(1), gt2)
         finally:
             os.remove(index_file)
             os.remove(bin_file)
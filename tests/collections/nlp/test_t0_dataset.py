@@ -0,0 +1,76 @@
+# Copyright (c) 2023, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+import torch
+
+from nemo.collections.nlp.data.language_modeling.t0_dataset import T0Dataset
+
+PAD_ID = 0
+
+
+class StubTokenizer:
+    pad_id = PAD_ID
+
+
+def get_dataset():
+    # collate_fn only needs the tokenizer, skip building the memmap dataset
+    dataset = T0Dataset.__new__(T0Dataset)
+    dataset.tokenizer = StubTokenizer()
+    return dataset
+
+
+def get_batch():
+    return [
+        {'text_enc': [5, 6, 7], 'text_dec': [1, 8, 9], 'labels': [8, 9, 2]},
+        {'text_enc': [5], 'text_dec': [1, 8, 9, 10], 'labels': [8, 9, 10, 2]},
+    ]
+
+
+def assert_long_equal(tensor, expected):
+    assert tensor.dtype == torch.int64
+    assert torch.equal(tensor, torch.tensor(expected, dtype=torch.int64))
+
+
+class TestT0Dataset:
+    @pytest.mark.unit
+    def test_collate_fn(self):
+        processed = get_dataset().collate_fn(get_batch())
+
+        assert set(processed.keys()) == {'text_enc', 'text_dec', 'labels', 'loss_mask', 'enc_mask', 'dec_mask'}
+        assert_long_equal(processed['text_enc'], [[5, 6, 7], [5, PAD_ID, PAD_ID]])
+        assert_long_equal(processed['text_dec'], [[1, 8, 9, PAD_ID], [1, 8, 9, 10]])
+        assert_long_equal(processed['labels'], [[8, 9, 2, PAD_ID], [8, 9, 10, 2]])
+        assert_long_equal(processed['loss_mask'], [[1, 1, 1, 0], [1, 1, 1, 1]])
+        assert_long_equal(processed['enc_mask'], [[1, 1, 1], [1, 0, 0]])
+        assert_long_equal(processed['dec_mask'], [[1, 1, 1, 0], [1, 1, 1, 1]])
+
+    @pytest.mark.unit
+    def test_collate_fn_optional_fields(self):
+        batch = get_batch()
+        batch[0].update({'original': [3, 4], 'template': [11]})
+        batch[1].update({'original': [3], 'template': [11, 12, 13]})
+        processed = get_dataset().collate_fn(batch)
+
+        assert 'prompt' not in processed
+        assert 'task_name_with_prompt' not in processed
+        assert_long_equal(processed['text_enc'], [[5, 6, 7], [5, PAD_ID, PAD_ID]])
+        assert_long_equal(processed['original'], [[3, 4], [3, PAD_ID]])
+        assert_long_equal(processed['template'], [[11, PAD_ID, PAD_ID], [11, 12, 13]])
+
+    @pytest.mark.unit
+    def test_collate_item_empty(self):
+        collated = get_dataset()._collate_item([])
+        assert collated.shape == (0, 0)
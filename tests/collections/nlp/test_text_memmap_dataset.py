@@ -0,0 +1,88 @@
+# Copyright (c) 2023, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+import pytest
+
+from nemo.collections.nlp.data.language_modeling import text_memmap_dataset
+from nemo.collections.nlp.data.language_modeling.text_memmap_dataset import _build_index_from_memdata
+
+NEWLINE_INT = ord('\n')
+
+
+def build_index_reference(fn, newline_int):
+    """
+    Previous list based index build, the chunked scan must produce the same index.
+    """
+    mdata = np.memmap(fn, dtype=np.uint8, mode="r")
+    midx = np.where(mdata == newline_int)[0]
+    midx_dtype = midx.dtype
+    midx = midx.tolist()
+    if (len(midx) == 0) or (midx[-1] + 1 != len(mdata)):
+        midx = midx + [len(mdata) + 1]
+    while len(midx) > 1 and (midx[-1] - midx[-2]) < 2:
+        midx.pop(-1)
+    midx = np.asarray(midx, dtype=midx_dtype)
+    mdata._mmap.close()
+    return midx
+
+
+def check_index(fn):
+    midx = _build_index_from_memdata(fn, NEWLINE_INT)
+    expected = build_index_reference(fn, NEWLINE_INT)
+    assert midx.dtype == expected.dtype
+    assert np.array_equal(midx, expected)
+
+
+class TestBuildIndexFromMemdata:
+    @pytest.mark.unit
+    @pytest.mark.parametrize(
+        "data",
+        [
+            b'{"a": 1}\n{"b": 2}',
+            b'{"a": 1}\n{"b": 2}\n',
+            b'{"a": 1}\n{"b": 2}\n\n\n\n',
+            b'\n\n{"a": 1}\n\n{"b": 2}\n\n',
+            b'{"a": 1}',
+            b'\n',
+            b'\n\n\n',
+        ],
+        ids=[
+            "no_trailing_newline",
+            "one_trailing_newline",
+            "trailing_blank_lines",
+            "inner_blank_lines",
+            "no_newline",
+            "only_newline",
+            "only_blank_lines",
+        ],
+    )
+    def test_build_index(self, tmp_path, data):
+        fn = str(tmp_path / "data.jsonl")
+        with open(fn, "wb") as f:
+            f.write(data)
+        check_index(fn)
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("scan_chunk", [1, 3, 64])
+    def test_build_index_multiple_scan_chunks(self, tmp_path, monkeypatch, scan_chunk):
+        monkeypatch.setattr(text_memmap_dataset, "_INDEX_SCAN_CHUNK", scan_chunk)
+        rng = np.random.default_rng(scan_chunk)
+        # short lines including empty ones, ending with blank lines
+        data = rng.choice(np.array([ord('a'), ord('b'), NEWLINE_INT], dtype=np.uint8), size=1000, p=[0.4, 0.4, 0.2])
+        fn = str(tmp_path / "data.jsonl")
+        with open(fn, "wb") as f:
+            f.write(data.tobytes() + b'\n\n\n')
+        check_index(fn)